@@ -1,58 +1,271 @@
-﻿import os
-from typing import Dict, Any, Optional
-
+﻿import asyncio
+import datetime as dt
+import logging
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from decimal import Decimal
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from uuid import UUID
+
+import asyncpg
+import httpx
+import orjson
+from cachetools import LRUCache, TTLCache
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
 from fastmcp import FastMCP
-from supabase import create_client, Client
+from pydantic import BaseModel, ConfigDict
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from supabase import acreate_client, AsyncClient, AsyncClientOptions, PostgrestAPIError
 
 
 url = os.environ["SUPABASE_URL"]
 key = os.environ["SUPABASE_SERVICE_ROLE_KEY"]  # esta, no anon
-supabase = create_client(url, key)
-
-print("has_service_role:", "SUPABASE_SERVICE_ROLE_KEY" in os.environ)
-print("service_role_len:", len(os.environ.get("SUPABASE_SERVICE_ROLE_KEY","")))
-print("anon_len:", len(os.environ.get("SUPABASE_ANON_KEY","")))
-
-DEFAULT_CUCKI_USER_ID = os.getenv("CUCKI_DEFAULT_USER_ID", "faf1e3b1-1bca-44b6-a36d-8f4f18138f56")
+db_url = os.environ["SUPABASE_DB_URL"]  # Postgres directo (session), para las lecturas
+redis_url = os.getenv("REDIS_URL")  # opcional: sin él no hay caché de listas
+
+logger = logging.getLogger(__name__)
+logger.debug(
+    "service_role_len=%d anon_len=%d",
+    len(key),
+    len(os.environ.get("SUPABASE_ANON_KEY", "")),
+)
+
+DEFAULT_CUCKI_USER_ID = os.getenv("CUCKI_DEFAULT_USER_ID", "faf1e3b1-1bca-44b6-a36d-8f4f18138f56").strip()
+# Canonical (lowercase) form, as Postgres returns it, so cache keys match the rows used to invalidate them.
+DEFAULT_CUCKI_USER_ID = str(UUID(DEFAULT_CUCKI_USER_ID)) if DEFAULT_CUCKI_USER_ID else ""
 SHOPPING_TABLE = "madriguera_shopping_list"
 WEEK_MENU_TABLE = "madriguera_week_menu"
 WEIGHT_ENTRIES_TABLE = "madriguera_weight_entries"
-
-sb: Optional[Client] = supabase
-
-
-def _db() -> Client:
+# Postgres functions (supabase/migrations) doing insert-or-update atomically, called via RPC.
+WEEK_MENU_UPSERT_FN = "madriguera_week_menu_upsert"
+WEIGHT_UPSERT_FN = "madriguera_weight_upsert"
+PG_UNIQUE_VIOLATION = "23505"
+
+SHOPPING_COLS = "id,user_id,name,category,qty,done,created_at"
+WEEK_MENU_COLS = "id,user_id,week_start,day_index,breakfast,lunch,dinner,is_done,created_at,updated_at"
+WEIGHT_COLS = "id,user_id,date,weight_kg,notes,created_at,updated_at"
+
+# Default projections for the list tools; callers can ask for any subset of *_COLS.
+SHOPPING_DEFAULT_FIELDS = "id,name,category,qty,done"
+WEEK_MENU_DEFAULT_FIELDS = "id,day_index,breakfast,lunch,dinner,is_done"
+WEIGHT_DEFAULT_FIELDS = "id,date,weight_kg,notes"
+
+# "{fields}" is filled with a projection already checked by _resolve_fields.
+SHOPPING_LIST_SQL = f"SELECT {{fields}} FROM {SHOPPING_TABLE} WHERE user_id=$1 ORDER BY created_at DESC"
+SHOPPING_PENDING_SQL = (
+    f"SELECT {{fields}} FROM {SHOPPING_TABLE} WHERE user_id=$1 AND done=false ORDER BY created_at DESC"
+)
+WEEK_MENU_LIST_SQL = (
+    f"SELECT {{fields}} FROM {WEEK_MENU_TABLE} WHERE user_id=$1 AND week_start=$2 ORDER BY day_index"
+)
+WEIGHT_LIST_SQL = f"SELECT {{fields}} FROM {WEIGHT_ENTRIES_TABLE} WHERE user_id=$1 ORDER BY date"
+
+POSTGREST_TIMEOUT = 120
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "10"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "50"))
+LIST_CACHE_TTL = int(os.getenv("LIST_CACHE_TTL", "10"))
+LOCAL_CACHE_TTL = int(os.getenv("LOCAL_CACHE_TTL", "5"))
+EMPTY_CACHE_TTL = int(os.getenv("EMPTY_CACHE_TTL", "60"))
+
+# Redis key prefixes for cached list responses: "<prefix>:<user_id>:<variant>".
+# "<prefix>:gen:<user_id>" counts that user's invalidations (outside the SCAN pattern).
+SHOPPING_CACHE = "shop"
+WEEK_MENU_CACHE = "menu"
+WEIGHT_CACHE = "weight"
+
+# SETEX only if the user's generation is still the one read before loading, so a fill
+# that raced a write (in any worker) can't put pre-write data back.
+_SETEX_IF_GEN = """
+if (redis.call('get', KEYS[2]) or '0') == ARGV[1] then
+  return redis.call('setex', KEYS[1], ARGV[2], ARGV[3])
+end
+return 0
+"""
+
+# Async client, created once in the app lifespan (acreate_client must be awaited).
+sb: Optional[AsyncClient] = None
+# asyncpg pool for the hot list reads; skips the PostgREST HTTP hop.
+pg: Optional[asyncpg.Pool] = None
+rds: Optional[Redis] = None
+# Per-process copy of hot list responses, checked before Redis. Only cleared by
+# this worker's own mutations, so other workers may serve it until it expires.
+_local_cache: TTLCache = TTLCache(maxsize=1024, ttl=LOCAL_CACHE_TTL)
+# Cache misses currently being loaded; concurrent callers for the same key share one load.
+_inflight: Dict[str, "asyncio.Task[dict]"] = {}
+# Prebuilt (response, encoded) pairs for lists last seen empty, reused instead of rebuilt.
+_empty_results: LRUCache = LRUCache(maxsize=1024)
+
+_DEFAULT_USER_ID_RESPONSE = {"ok": True, "user_id": DEFAULT_CUCKI_USER_ID}
+_ROOT_BYTES = orjson.dumps({"ok": True, "msg": "Cucki Planner MCP online"})
+
+
+def _db() -> AsyncClient:
     if sb is None:
-        raise RuntimeError("Supabase not configured (missing SUPABASE_URL / SUPABASE_*_KEY)")
+        raise RuntimeError("Supabase client not initialized (app lifespan not started)")
     return sb
 
 
+def _pg() -> asyncpg.Pool:
+    if pg is None:
+        raise RuntimeError("Postgres pool not initialized (app lifespan not started)")
+    return pg
+
+
+async def _cached(key: str, load: Callable[[], Awaitable[dict]]) -> dict:
+    result = _local_cache.get(key)
+    if result is not None:
+        return result
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fill(key, load))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _inflight.pop(key) if _inflight.get(key) is done else None)
+    # Shielded so one caller being cancelled does not cancel the load for the others.
+    return await asyncio.shield(task)
+
+
+def _gen_key(key: str) -> str:
+    prefix, user_id, _ = key.split(":", 2)
+    return f"{prefix}:gen:{user_id}"
+
+
+async def _fill(key: str, load: Callable[[], Awaitable[dict]]) -> dict:
+    cached, generation = None, None
+    if rds is not None:
+        try:
+            cached, generation = await rds.mget(key, _gen_key(key))
+        except RedisError:
+            pass
+    empty = _empty_results.get(key)
+    if cached and empty is not None and cached == empty[1]:
+        result = empty[0]
+    elif cached:
+        result = orjson.loads(cached)
+    else:
+        result = await load()
+        if _inflight.get(key) is not asyncio.current_task():
+            return result  # invalidated while loading: don't cache what may be stale
+        if result["items"]:
+            payload, ttl = None, LIST_CACHE_TTL
+        else:
+            # "Nothing yet" is the common polling answer and rarely changes second to second.
+            if empty is None:
+                empty = _empty_results[key] = (result, orjson.dumps(result))
+            result, payload = empty
+            ttl = EMPTY_CACHE_TTL
+        if rds is not None:
+            try:
+                await rds.eval(
+                    _SETEX_IF_GEN, 2, key, _gen_key(key), generation or b"0", ttl, payload or orjson.dumps(result)
+                )
+            except RedisError:
+                pass
+    # Re-checked after every await: a mutation may have invalidated the key meanwhile.
+    if _inflight.get(key) is asyncio.current_task():
+        _local_cache[key] = result
+    return result
+
+
+def _drop_local(prefix: str, user_ids: set[str]) -> None:
+    for user_id in user_ids:
+        stale = f"{prefix}:{user_id}:"
+        for cache_key in [k for k in _local_cache if k.startswith(stale)]:
+            _local_cache.pop(cache_key, None)
+        for cache_key in [k for k in _inflight if k.startswith(stale)]:
+            _inflight.pop(cache_key, None)
+
+
+async def _invalidate_lists(prefix: str, rows: List[Dict[str, Any]]) -> None:
+    # Mutations return the affected rows, so their user_id tells us which lists went stale.
+    user_ids = {row.get("user_id") for row in rows if row.get("user_id")}
+    _drop_local(prefix, user_ids)
+    if rds is None:
+        return
+    try:
+        for user_id in user_ids:
+            await rds.incr(f"{prefix}:gen:{user_id}")
+            keys = [k async for k in rds.scan_iter(match=f"{prefix}:{user_id}:*")]
+            if keys:
+                await rds.delete(*keys)
+    except RedisError:
+        pass
+    # Again after the Redis delete: a fill started meanwhile may have cached the old Redis value.
+    _drop_local(prefix, user_ids)
+
+
+def _pg_row(record: asyncpg.Record) -> Dict[str, Any]:
+    # Match the JSON shapes PostgREST returns (uuid/dates as strings, numeric as number).
+    row = dict(record)
+    for column, value in row.items():
+        if isinstance(value, UUID):
+            row[column] = str(value)
+        elif isinstance(value, (dt.date, dt.datetime)):
+            row[column] = value.isoformat()
+        elif isinstance(value, Decimal):
+            row[column] = float(value)
+    return row
+
+
+def _pg_date(value: str) -> dt.date:
+    try:
+        return dt.date.fromisoformat(value)
+    except ValueError:
+        raise RuntimeError(f"Invalid date {value!r} (expected YYYY-MM-DD)")
+
+
 def _resolve_user_id(user_id: str | None) -> str:
-    resolved = (user_id or DEFAULT_CUCKI_USER_ID or "").strip()
+    if not user_id:
+        resolved = DEFAULT_CUCKI_USER_ID
+    else:
+        resolved = user_id.strip()
+        if resolved:
+            try:
+                resolved = str(UUID(resolved))
+            except ValueError:
+                raise RuntimeError(f"Invalid user_id {user_id!r} (expected a UUID)")
     if not resolved:
         raise RuntimeError("Missing user_id and CUCKI_DEFAULT_USER_ID")
     return resolved
 
 
-def _shopping_select_query(user_id: str):
-    return (
-        _db()
-        .table(SHOPPING_TABLE)
-        .select("id,user_id,name,category,qty,done,created_at")
-        .eq("user_id", user_id)
-    )
+async def _shopping_select_query(
+    user_id: str,
+    include_done: bool = True,
+    fields: str = SHOPPING_DEFAULT_FIELDS,
+) -> List[Dict[str, Any]]:
+    sql = SHOPPING_LIST_SQL if include_done else SHOPPING_PENDING_SQL
+    rows = await _pg().fetch(sql.format(fields=fields), user_id)
+    return [_pg_row(r) for r in rows]
 
 
-def _shopping_insert(user_id: str, name: str, category: str, qty: str, done: bool = False) -> Dict[str, Any]:
-    payload = {
+class ShoppingItem(BaseModel):
+    """One item for planner_shopping_add_many; defaults match planner_shopping_add."""
+
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    name: str
+    category: str = "Otros"
+    qty: str = "1"
+    done: bool = False
+
+
+def _shopping_payload(user_id: str, name: str, category: str, qty: str, done: bool = False) -> Dict[str, Any]:
+    return {
         "user_id": user_id,
         "name": name,
         "category": category,
         "qty": qty,
         "done": done,
     }
-    res = _db().table(SHOPPING_TABLE).insert(payload).execute()
+
+
+async def _shopping_insert(user_id: str, name: str, category: str, qty: str, done: bool = False) -> Dict[str, Any]:
+    payload = _shopping_payload(user_id, name, category, qty, done)
+    res = await _db().table(SHOPPING_TABLE).insert(payload).execute()
     return (res.data or [{}])[0]
 
 
@@ -63,7 +276,25 @@ def _resolve_week_start(week_start: str | None) -> str:
     return value
 
 
+@lru_cache(maxsize=256)
+def _resolve_fields(fields: str, allowed: str) -> str:
+    # Also guards the SQL: only known column names ever reach the SELECT list.
+    allowed_cols = allowed.split(",")
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    if not requested:
+        raise RuntimeError(f"fields must list at least one of: {allowed}")
+    unknown = [f for f in requested if f not in allowed_cols]
+    if unknown:
+        raise RuntimeError(f"Unknown fields {','.join(unknown)} (allowed: {allowed})")
+    return ",".join(requested)
+
+
+_VALID_DAY_INDEXES = frozenset(range(1, 8))
+
+
 def _resolve_day_index(day_index: int) -> int:
+    if type(day_index) is int and day_index in _VALID_DAY_INDEXES:
+        return day_index
     if not isinstance(day_index, int):
         raise RuntimeError("day_index must be an integer")
     if day_index < 1 or day_index > 7:
@@ -79,6 +310,8 @@ def _resolve_date(value: str | None) -> str:
 
 
 def _resolve_weight_kg(value: float) -> float:
+    if type(value) is float:
+        return value
     try:
         resolved = float(value)
     except (TypeError, ValueError):
@@ -86,26 +319,41 @@ def _resolve_weight_kg(value: float) -> float:
     return resolved
 
 
+def _changes(*fields: tuple[str, Any, Optional[Callable[[Any], Any]]]) -> Dict[str, Any]:
+    # (column, value, transform) triples; None values are left out of the update.
+    return {
+        column: transform(value) if transform else value
+        for column, value, transform in fields
+        if value is not None
+    }
+
+
 mcp = FastMCP("Cucki Planner MCP")
 
 
 @mcp.tool
-def planner_default_user_id() -> dict:
-    return {"ok": True, "user_id": DEFAULT_CUCKI_USER_ID}
+async def planner_default_user_id() -> dict:
+    return _DEFAULT_USER_ID_RESPONSE
 
 
 @mcp.tool
-def planner_shopping_list(user_id: str | None = None, include_done: bool = True) -> dict:
+async def planner_shopping_list(
+    user_id: str | None = None,
+    include_done: bool = True,
+    fields: str = SHOPPING_DEFAULT_FIELDS,
+) -> dict:
     resolved_user_id = _resolve_user_id(user_id)
-    query = _shopping_select_query(resolved_user_id)
-    if not include_done:
-        query = query.eq("done", False)
-    res = query.order("created_at", desc=True).execute()
-    return {"ok": True, "user_id": resolved_user_id, "items": res.data or []}
+    resolved_fields = _resolve_fields(fields, SHOPPING_COLS)
+
+    async def load() -> dict:
+        items = await _shopping_select_query(resolved_user_id, include_done=include_done, fields=resolved_fields)
+        return {"ok": True, "user_id": resolved_user_id, "items": items}
+
+    return await _cached(f"{SHOPPING_CACHE}:{resolved_user_id}:{int(include_done)}:{resolved_fields}", load)
 
 
 @mcp.tool
-def planner_shopping_add(
+async def planner_shopping_add(
     name: str,
     user_id: str | None = None,
     category: str = "Otros",
@@ -113,12 +361,29 @@ def planner_shopping_add(
     done: bool = False,
 ) -> dict:
     resolved_user_id = _resolve_user_id(user_id)
-    row = _shopping_insert(user_id=resolved_user_id, name=name, category=category, qty=qty, done=done)
+    row = await _shopping_insert(user_id=resolved_user_id, name=name, category=category, qty=qty, done=done)
+    await _invalidate_lists(SHOPPING_CACHE, [row])
     return {"ok": True, "user_id": resolved_user_id, "item": row}
 
 
 @mcp.tool
-def planner_shopping_update(
+async def planner_shopping_add_many(items: list[ShoppingItem], user_id: str | None = None) -> dict:
+    """Add several items in one insert."""
+    resolved_user_id = _resolve_user_id(user_id)
+    payload = [
+        _shopping_payload(resolved_user_id, item.name, item.category, item.qty, item.done)
+        for item in items
+    ]
+    if not payload:
+        return {"ok": False, "error": "No items to add"}
+
+    res = await _db().table(SHOPPING_TABLE).insert(payload).execute()
+    await _invalidate_lists(SHOPPING_CACHE, res.data or [])
+    return {"ok": True, "user_id": resolved_user_id, "items": res.data or []}
+
+
+@mcp.tool
+async def planner_shopping_update(
     item_id: str,
     name: str | None = None,
     category: str | None = None,
@@ -126,66 +391,71 @@ def planner_shopping_update(
     done: bool | None = None,
     user_id: str | None = None,
 ) -> dict:
-    changes: Dict[str, Any] = {}
-    if name is not None:
-        changes["name"] = name
-    if category is not None:
-        changes["category"] = category
-    if qty is not None:
-        changes["qty"] = qty
-    if done is not None:
-        changes["done"] = done
+    changes = _changes(
+        ("name", name, None),
+        ("category", category, None),
+        ("qty", qty, None),
+        ("done", done, None),
+    )
     if not changes:
         return {"ok": False, "error": "No fields to update"}
 
     query = _db().table(SHOPPING_TABLE).update(changes).eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(SHOPPING_CACHE, res.data or [])
     return {"ok": True, "updated": res.data or []}
 
 
 @mcp.tool
-def planner_shopping_set_done(item_id: str, done: bool = True, user_id: str | None = None) -> dict:
+async def planner_shopping_set_done(item_id: str, done: bool = True, user_id: str | None = None) -> dict:
     query = _db().table(SHOPPING_TABLE).update({"done": done}).eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(SHOPPING_CACHE, res.data or [])
     return {"ok": True, "updated": res.data or []}
 
 
 @mcp.tool
-def planner_shopping_delete(item_id: str, user_id: str | None = None) -> dict:
+async def planner_shopping_delete(item_id: str, user_id: str | None = None) -> dict:
     query = _db().table(SHOPPING_TABLE).delete().eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(SHOPPING_CACHE, res.data or [])
     return {"ok": True, "deleted": res.data or []}
 
 
 @mcp.tool
-def planner_week_menu_list(user_id: str | None = None, week_start: str | None = None) -> dict:
+async def planner_week_menu_list(
+    user_id: str | None = None,
+    week_start: str | None = None,
+    fields: str = WEEK_MENU_DEFAULT_FIELDS,
+) -> dict:
     resolved_user_id = _resolve_user_id(user_id)
     resolved_week_start = _resolve_week_start(week_start)
-    res = (
-        _db()
-        .table(WEEK_MENU_TABLE)
-        .select("id,user_id,week_start,day_index,breakfast,lunch,dinner,is_done,created_at,updated_at")
-        .eq("user_id", resolved_user_id)
-        .eq("week_start", resolved_week_start)
-        .order("day_index", desc=False)
-        .execute()
-    )
-    return {
-        "ok": True,
-        "user_id": resolved_user_id,
-        "week_start": resolved_week_start,
-        "items": res.data or [],
-    }
+    resolved_fields = _resolve_fields(fields, WEEK_MENU_COLS)
+
+    async def load() -> dict:
+        rows = await _pg().fetch(
+            WEEK_MENU_LIST_SQL.format(fields=resolved_fields),
+            resolved_user_id,
+            _pg_date(resolved_week_start),
+        )
+        return {
+            "ok": True,
+            "user_id": resolved_user_id,
+            "week_start": resolved_week_start,
+            "items": [_pg_row(r) for r in rows],
+        }
+
+    return await _cached(f"{WEEK_MENU_CACHE}:{resolved_user_id}:{resolved_week_start}:{resolved_fields}", load)
 
 
 @mcp.tool
-def planner_week_menu_add(
+async def planner_week_menu_add(
     day_index: int,
     breakfast: str = "",
     lunch: str = "",
@@ -207,12 +477,22 @@ def planner_week_menu_add(
         "dinner": dinner,
         "is_done": is_done,
     }
-    res = _db().table(WEEK_MENU_TABLE).insert(payload).execute()
+    try:
+        res = await _db().table(WEEK_MENU_TABLE).insert(payload).execute()
+    except PostgrestAPIError as exc:
+        if exc.code != PG_UNIQUE_VIOLATION:
+            raise
+        return {
+            "ok": False,
+            "error": f"Day {resolved_day_index} of week {resolved_week_start} already exists; "
+            "use planner_week_menu_upsert_day or planner_week_menu_update",
+        }
+    await _invalidate_lists(WEEK_MENU_CACHE, res.data or [])
     return {"ok": True, "item": (res.data or [{}])[0]}
 
 
 @mcp.tool
-def planner_week_menu_update(
+async def planner_week_menu_update(
     item_id: str,
     breakfast: str | None = None,
     lunch: str | None = None,
@@ -222,17 +502,13 @@ def planner_week_menu_update(
     user_id: str | None = None,
     week_start: str | None = None,
 ) -> dict:
-    changes: Dict[str, Any] = {}
-    if breakfast is not None:
-        changes["breakfast"] = breakfast
-    if lunch is not None:
-        changes["lunch"] = lunch
-    if dinner is not None:
-        changes["dinner"] = dinner
-    if is_done is not None:
-        changes["is_done"] = is_done
-    if day_index is not None:
-        changes["day_index"] = _resolve_day_index(day_index)
+    changes = _changes(
+        ("breakfast", breakfast, None),
+        ("lunch", lunch, None),
+        ("dinner", dinner, None),
+        ("is_done", is_done, None),
+        ("day_index", day_index, _resolve_day_index),
+    )
     if not changes:
         return {"ok": False, "error": "No fields to update"}
 
@@ -241,23 +517,25 @@ def planner_week_menu_update(
         query = query.eq("user_id", user_id)
     if week_start:
         query = query.eq("week_start", week_start)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(WEEK_MENU_CACHE, res.data or [])
     return {"ok": True, "updated": res.data or []}
 
 
 @mcp.tool
-def planner_week_menu_delete(item_id: str, user_id: str | None = None, week_start: str | None = None) -> dict:
+async def planner_week_menu_delete(item_id: str, user_id: str | None = None, week_start: str | None = None) -> dict:
     query = _db().table(WEEK_MENU_TABLE).delete().eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
     if week_start:
         query = query.eq("week_start", week_start)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(WEEK_MENU_CACHE, res.data or [])
     return {"ok": True, "deleted": res.data or []}
 
 
 @mcp.tool
-def planner_week_menu_upsert_day(
+async def planner_week_menu_upsert_day(
     day_index: int,
     breakfast: str = "",
     lunch: str = "",
@@ -270,65 +548,36 @@ def planner_week_menu_upsert_day(
     resolved_week_start = _resolve_week_start(week_start)
     resolved_day_index = _resolve_day_index(day_index)
 
-    existing = (
-        _db()
-        .table(WEEK_MENU_TABLE)
-        .select("id,user_id,week_start,day_index,breakfast,lunch,dinner,is_done,created_at,updated_at")
-        .eq("user_id", resolved_user_id)
-        .eq("week_start", resolved_week_start)
-        .eq("day_index", resolved_day_index)
-        .limit(1)
-        .execute()
-    )
-
-    if existing.data:
-        row_id = existing.data[0]["id"]
-        changes = {
-            "breakfast": breakfast,
-            "lunch": lunch,
-            "dinner": dinner,
-            "is_done": is_done,
-        }
-        updated = (
-            _db()
-            .table(WEEK_MENU_TABLE)
-            .update(changes)
-            .eq("id", row_id)
-            .eq("user_id", resolved_user_id)
-            .eq("week_start", resolved_week_start)
-            .execute()
-        )
-        return {"ok": True, "mode": "updated", "item": (updated.data or [{}])[0]}
-
-    payload = {
-        "user_id": resolved_user_id,
-        "week_start": resolved_week_start,
-        "day_index": resolved_day_index,
-        "breakfast": breakfast,
-        "lunch": lunch,
-        "dinner": dinner,
-        "is_done": is_done,
+    params = {
+        "p_user_id": resolved_user_id,
+        "p_week_start": resolved_week_start,
+        "p_day_index": resolved_day_index,
+        "p_breakfast": breakfast,
+        "p_lunch": lunch,
+        "p_dinner": dinner,
+        "p_is_done": is_done,
     }
-    inserted = _db().table(WEEK_MENU_TABLE).insert(payload).execute()
-    return {"ok": True, "mode": "inserted", "item": (inserted.data or [{}])[0]}
+    res = await _db().rpc(WEEK_MENU_UPSERT_FN, params).execute()
+    result = res.data or {}
+    item = result.get("item") or {}
+    await _invalidate_lists(WEEK_MENU_CACHE, [item])
+    return {"ok": True, "mode": result.get("mode"), "item": item}
 
 
 @mcp.tool
-def planner_weight_list(user_id: str | None = None) -> dict:
+async def planner_weight_list(user_id: str | None = None, fields: str = WEIGHT_DEFAULT_FIELDS) -> dict:
     resolved_user_id = _resolve_user_id(user_id)
-    res = (
-        _db()
-        .table(WEIGHT_ENTRIES_TABLE)
-        .select("id,user_id,date,weight_kg,notes,created_at,updated_at")
-        .eq("user_id", resolved_user_id)
-        .order("date", desc=False)
-        .execute()
-    )
-    return {"ok": True, "user_id": resolved_user_id, "items": res.data or []}
+    resolved_fields = _resolve_fields(fields, WEIGHT_COLS)
+
+    async def load() -> dict:
+        rows = await _pg().fetch(WEIGHT_LIST_SQL.format(fields=resolved_fields), resolved_user_id)
+        return {"ok": True, "user_id": resolved_user_id, "items": [_pg_row(r) for r in rows]}
+
+    return await _cached(f"{WEIGHT_CACHE}:{resolved_user_id}:{resolved_fields}", load)
 
 
 @mcp.tool
-def planner_weight_add(
+async def planner_weight_add(
     date: str,
     weight_kg: float,
     notes: str | None = None,
@@ -343,46 +592,56 @@ def planner_weight_add(
         "weight_kg": resolved_weight_kg,
         "notes": notes,
     }
-    res = _db().table(WEIGHT_ENTRIES_TABLE).insert(payload).execute()
+    try:
+        res = await _db().table(WEIGHT_ENTRIES_TABLE).insert(payload).execute()
+    except PostgrestAPIError as exc:
+        if exc.code != PG_UNIQUE_VIOLATION:
+            raise
+        return {
+            "ok": False,
+            "error": f"A weight entry for {resolved_date} already exists; "
+            "use planner_weight_upsert_by_date or planner_weight_update",
+        }
+    await _invalidate_lists(WEIGHT_CACHE, res.data or [])
     return {"ok": True, "item": (res.data or [{}])[0]}
 
 
 @mcp.tool
-def planner_weight_update(
+async def planner_weight_update(
     item_id: str,
     date: str | None = None,
     weight_kg: float | None = None,
     notes: str | None = None,
     user_id: str | None = None,
 ) -> dict:
-    changes: Dict[str, Any] = {}
-    if date is not None:
-        changes["date"] = _resolve_date(date)
-    if weight_kg is not None:
-        changes["weight_kg"] = _resolve_weight_kg(weight_kg)
-    if notes is not None:
-        changes["notes"] = notes
+    changes = _changes(
+        ("date", date, _resolve_date),
+        ("weight_kg", weight_kg, _resolve_weight_kg),
+        ("notes", notes, None),
+    )
     if not changes:
         return {"ok": False, "error": "No fields to update"}
 
     query = _db().table(WEIGHT_ENTRIES_TABLE).update(changes).eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(WEIGHT_CACHE, res.data or [])
     return {"ok": True, "updated": res.data or []}
 
 
 @mcp.tool
-def planner_weight_delete(item_id: str, user_id: str | None = None) -> dict:
+async def planner_weight_delete(item_id: str, user_id: str | None = None) -> dict:
     query = _db().table(WEIGHT_ENTRIES_TABLE).delete().eq("id", item_id)
     if user_id:
         query = query.eq("user_id", user_id)
-    res = query.execute()
+    res = await query.execute()
+    await _invalidate_lists(WEIGHT_CACHE, res.data or [])
     return {"ok": True, "deleted": res.data or []}
 
 
 @mcp.tool
-def planner_weight_upsert_by_date(
+async def planner_weight_upsert_by_date(
     date: str,
     weight_kg: float,
     notes: str | None = None,
@@ -392,46 +651,63 @@ def planner_weight_upsert_by_date(
     resolved_date = _resolve_date(date)
     resolved_weight_kg = _resolve_weight_kg(weight_kg)
 
-    existing = (
-        _db()
-        .table(WEIGHT_ENTRIES_TABLE)
-        .select("id,user_id,date,weight_kg,notes,created_at,updated_at")
-        .eq("user_id", resolved_user_id)
-        .eq("date", resolved_date)
-        .limit(1)
-        .execute()
-    )
-
-    if existing.data:
-        row_id = existing.data[0]["id"]
-        changes = {"weight_kg": resolved_weight_kg, "notes": notes}
-        updated = (
-            _db()
-            .table(WEIGHT_ENTRIES_TABLE)
-            .update(changes)
-            .eq("id", row_id)
-            .eq("user_id", resolved_user_id)
-            .execute()
-        )
-        return {"ok": True, "mode": "updated", "item": (updated.data or [{}])[0]}
-
-    payload = {
-        "user_id": resolved_user_id,
-        "date": resolved_date,
-        "weight_kg": resolved_weight_kg,
-        "notes": notes,
+    params = {
+        "p_user_id": resolved_user_id,
+        "p_date": resolved_date,
+        "p_weight_kg": resolved_weight_kg,
+        "p_notes": notes,
     }
-    inserted = _db().table(WEIGHT_ENTRIES_TABLE).insert(payload).execute()
-    return {"ok": True, "mode": "inserted", "item": (inserted.data or [{}])[0]}
+    res = await _db().rpc(WEIGHT_UPSERT_FN, params).execute()
+    result = res.data or {}
+    item = result.get("item") or {}
+    await _invalidate_lists(WEIGHT_CACHE, [item])
+    return {"ok": True, "mode": result.get("mode"), "item": item}
+
+
+# Plain JSON replies instead of SSE, so GZipMiddleware (which skips text/event-stream)
+# can compress large tool results.
+mcp_app = mcp.http_app(path="/", json_response=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global sb, pg, rds
+    # Each resource is closed on its own, in reverse order, even if a later one fails to
+    # open or an earlier close raises.
+    async with AsyncExitStack() as stack:
+        # One pooled HTTP/2 connection set to PostgREST, shared by every tool call. postgrest
+        # uses an injected client as-is, so restate its own defaults (120 s timeout, redirects).
+        http = await stack.enter_async_context(
+            httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+                http2=True,
+                timeout=POSTGREST_TIMEOUT,
+                follow_redirects=True,
+            )
+        )
+        sb = await acreate_client(url, key, options=AsyncClientOptions(httpx_client=http))
+        rds = await stack.enter_async_context(Redis.from_url(redis_url)) if redis_url else None
+        pg = await stack.enter_async_context(
+            asyncpg.create_pool(
+                dsn=db_url,
+                min_size=PG_POOL_MIN_SIZE,
+                max_size=PG_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=300,
+                statement_cache_size=1024,
+            )
+        )
+        app.state.pg = pg
+        async with mcp_app.lifespan(app):
+            yield
 
 
-mcp_app = mcp.http_app(path="/")
-app = FastAPI(lifespan=mcp_app.lifespan)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 
 @app.get("/")
-def root():
-    return {"ok": True, "msg": "Cucki Planner MCP online"}
+async def root():
+    return Response(_ROOT_BYTES, media_type="application/json")
 
 
 app.mount("/mcp", mcp_app)
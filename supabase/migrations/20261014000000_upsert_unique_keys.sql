@@ -0,0 +1,50 @@
+-- Natural keys for planner_week_menu_upsert_day / planner_weight_upsert_by_date,
+-- which rely on ON CONFLICT (PostgREST upsert with on_conflict=...).
+
+-- Keep only the most recently written row per key before adding the constraints.
+-- The old upsert tools updated whichever row limit(1) returned, so the newest edit
+-- can live in an older row: rank by last write, not by creation. Removed rows are
+-- kept in *_dedupe_backup tables (RLS on, no policies: service role only).
+create table if not exists public.madriguera_week_menu_dedupe_backup
+  (like public.madriguera_week_menu);
+alter table public.madriguera_week_menu_dedupe_backup enable row level security;
+
+with ranked as (
+  select id, row_number() over (
+    partition by user_id, week_start, day_index
+    order by coalesce(updated_at, created_at) desc, id desc
+  ) as rn
+  from public.madriguera_week_menu
+), removed as (
+  delete from public.madriguera_week_menu m
+  using ranked r
+  where m.id = r.id and r.rn > 1
+  returning m.*
+)
+insert into public.madriguera_week_menu_dedupe_backup
+select * from removed;
+
+create table if not exists public.madriguera_weight_entries_dedupe_backup
+  (like public.madriguera_weight_entries);
+alter table public.madriguera_weight_entries_dedupe_backup enable row level security;
+
+with ranked as (
+  select id, row_number() over (
+    partition by user_id, date
+    order by coalesce(updated_at, created_at) desc, id desc
+  ) as rn
+  from public.madriguera_weight_entries
+), removed as (
+  delete from public.madriguera_weight_entries w
+  using ranked r
+  where w.id = r.id and r.rn > 1
+  returning w.*
+)
+insert into public.madriguera_weight_entries_dedupe_backup
+select * from removed;
+
+create unique index if not exists madriguera_week_menu_user_week_day_key
+  on public.madriguera_week_menu (user_id, week_start, day_index);
+
+create unique index if not exists madriguera_weight_entries_user_date_key
+  on public.madriguera_weight_entries (user_id, date);
@@ -0,0 +1,8 @@
+-- planner_shopping_list: where user_id = $1 [and done = false] order by created_at desc.
+-- Lets Postgres walk the index in order instead of sorting each request.
+create index if not exists madriguera_shopping_list_user_created_idx
+  on public.madriguera_shopping_list (user_id, created_at desc);
+
+-- planner_week_menu_list (user_id, week_start order by day_index) and
+-- planner_weight_list (user_id order by date) are already served by the
+-- unique indexes from 20261014000000_upsert_unique_keys.sql.
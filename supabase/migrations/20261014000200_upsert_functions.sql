@@ -0,0 +1,77 @@
+-- Atomic insert-or-update for planner_week_menu_upsert_day / planner_weight_upsert_by_date,
+-- called through PostgREST RPC. Both rely on the unique keys from
+-- 20261014000000_upsert_unique_keys.sql and return {"mode": "inserted"|"updated", "item": row}
+-- (xmax = 0 only for a freshly inserted tuple).
+
+create or replace function public.madriguera_week_menu_upsert(
+  p_user_id uuid,
+  p_week_start date,
+  p_day_index int,
+  p_breakfast text default '',
+  p_lunch text default '',
+  p_dinner text default '',
+  p_is_done boolean default false
+) returns jsonb
+language plpgsql
+set search_path = public
+as $$
+declare
+  v_item jsonb;
+  v_inserted boolean;
+begin
+  insert into public.madriguera_week_menu as m
+    (user_id, week_start, day_index, breakfast, lunch, dinner, is_done)
+  values
+    (p_user_id, p_week_start, p_day_index, p_breakfast, p_lunch, p_dinner, p_is_done)
+  on conflict (user_id, week_start, day_index) do update
+    set breakfast = excluded.breakfast,
+        lunch = excluded.lunch,
+        dinner = excluded.dinner,
+        is_done = excluded.is_done
+  returning to_jsonb(m.*), (m.xmax = 0) into v_item, v_inserted;
+
+  return jsonb_build_object(
+    'mode', case when v_inserted then 'inserted' else 'updated' end,
+    'item', v_item
+  );
+end;
+$$;
+
+create or replace function public.madriguera_weight_upsert(
+  p_user_id uuid,
+  p_date date,
+  p_weight_kg numeric,
+  p_notes text default null
+) returns jsonb
+language plpgsql
+set search_path = public
+as $$
+declare
+  v_item jsonb;
+  v_inserted boolean;
+begin
+  insert into public.madriguera_weight_entries as w
+    (user_id, date, weight_kg, notes)
+  values
+    (p_user_id, p_date, p_weight_kg, p_notes)
+  on conflict (user_id, date) do update
+    set weight_kg = excluded.weight_kg,
+        notes = excluded.notes
+  returning to_jsonb(w.*), (w.xmax = 0) into v_item, v_inserted;
+
+  return jsonb_build_object(
+    'mode', case when v_inserted then 'inserted' else 'updated' end,
+    'item', v_item
+  );
+end;
+$$;
+
+-- They take an arbitrary user id, so only the backend (service role) may call them.
+revoke execute on function public.madriguera_week_menu_upsert(uuid, date, int, text, text, text, boolean)
+  from public, anon, authenticated;
+revoke execute on function public.madriguera_weight_upsert(uuid, date, numeric, text)
+  from public, anon, authenticated;
+grant execute on function public.madriguera_week_menu_upsert(uuid, date, int, text, text, text, boolean)
+  to service_role;
+grant execute on function public.madriguera_weight_upsert(uuid, date, numeric, text)
+  to service_role;
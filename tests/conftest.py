@@ -0,0 +1,9 @@
+import os
+import sys
+
+# cucki_main reads these at import; nothing connects until the app lifespan runs.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test-service-role-key")
+os.environ.setdefault("SUPABASE_DB_URL", "postgresql://localhost/test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
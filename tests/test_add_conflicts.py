@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from supabase import PostgrestAPIError
+
+import cucki_main
+
+
+class _ConflictingTable:
+    def __init__(self, code):
+        self.code = code
+
+    def insert(self, payload):
+        return self
+
+    async def execute(self):
+        raise PostgrestAPIError({"code": self.code, "message": "insert failed", "details": None, "hint": None})
+
+
+class _FakeClient:
+    def __init__(self, code):
+        self.code = code
+
+    def table(self, name):
+        return _ConflictingTable(self.code)
+
+
+@pytest.fixture
+def conflicting_db(monkeypatch):
+    monkeypatch.setattr(cucki_main, "sb", _FakeClient(cucki_main.PG_UNIQUE_VIOLATION))
+
+
+def test_week_menu_add_existing_day_points_to_upsert(conflicting_db):
+    res = asyncio.run(cucki_main.planner_week_menu_add(day_index=2, week_start="2026-10-12"))
+    assert res["ok"] is False
+    assert "planner_week_menu_upsert_day" in res["error"]
+
+
+def test_weight_add_existing_date_points_to_upsert(conflicting_db):
+    res = asyncio.run(cucki_main.planner_weight_add(date="2026-10-14", weight_kg=70.5))
+    assert res["ok"] is False
+    assert "planner_weight_upsert_by_date" in res["error"]
+
+
+def test_other_api_errors_still_raise(monkeypatch):
+    monkeypatch.setattr(cucki_main, "sb", _FakeClient("42501"))
+    with pytest.raises(PostgrestAPIError):
+        asyncio.run(cucki_main.planner_weight_add(date="2026-10-14", weight_kg=70.5))
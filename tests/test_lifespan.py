@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+import cucki_main
+
+
+def test_http_client_closed_when_pool_creation_fails(monkeypatch):
+    clients = []
+
+    async def fake_acreate_client(url, key, options):
+        clients.append(options.httpx_client)
+        return object()
+
+    def failing_create_pool(**kwargs):
+        raise OSError("db unreachable")
+
+    monkeypatch.setattr(cucki_main, "acreate_client", fake_acreate_client)
+    monkeypatch.setattr(cucki_main.asyncpg, "create_pool", failing_create_pool)
+    monkeypatch.setattr(cucki_main, "redis_url", None)
+
+    async def main():
+        async with cucki_main.lifespan(cucki_main.app):
+            pass
+
+    with pytest.raises(OSError):
+        asyncio.run(main())
+    assert clients and clients[0].is_closed
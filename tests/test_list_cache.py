@@ -0,0 +1,139 @@
+import asyncio
+
+import orjson
+import pytest
+from cachetools import LRUCache, TTLCache
+
+import cucki_main
+
+USER_ID = "faf1e3b1-1bca-44b6-a36d-8f4f18138f56"
+KEY = f"{cucki_main.SHOPPING_CACHE}:{USER_ID}:1:{cucki_main.SHOPPING_DEFAULT_FIELDS}"
+
+
+class FakeRedis:
+    """Dict-backed stand-in for redis.asyncio.Redis that yields to the loop on every call."""
+
+    def __init__(self):
+        self.data = {}
+        # Cleared to hold SCAN (and so the delete after it) until the test sets it.
+        self.scan_gate = asyncio.Event()
+        self.scan_gate.set()
+        self.scanning = asyncio.Event()
+
+    async def get(self, key):
+        await asyncio.sleep(0)
+        return self.data.get(key)
+
+    async def setex(self, key, ttl, value):
+        await asyncio.sleep(0)
+        self.data[key] = value
+
+    async def mget(self, *keys):
+        await asyncio.sleep(0)
+        return [self.data.get(key) for key in keys]
+
+    async def incr(self, key):
+        await asyncio.sleep(0)
+        self.data[key] = str(int(self.data.get(key) or 0) + 1).encode()
+        return int(self.data[key])
+
+    async def eval(self, script, numkeys, key, gen_key, generation, ttl, value):
+        # Only cucki_main._SETEX_IF_GEN is ever evaluated.
+        assert script == cucki_main._SETEX_IF_GEN
+        await asyncio.sleep(0)
+        if (self.data.get(gen_key) or b"0") == generation:
+            self.data[key] = value
+            return True
+        return 0
+
+    async def delete(self, *keys):
+        await asyncio.sleep(0)
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def scan_iter(self, match):
+        self.scanning.set()
+        await self.scan_gate.wait()
+        prefix = match.rstrip("*")
+        for key in [k for k in self.data if k.startswith(prefix)]:
+            yield key
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(cucki_main, "rds", redis)
+    monkeypatch.setattr(cucki_main, "_local_cache", TTLCache(maxsize=1024, ttl=60))
+    monkeypatch.setattr(cucki_main, "_inflight", {})
+    monkeypatch.setattr(cucki_main, "_empty_results", LRUCache(maxsize=1024))
+    return redis
+
+
+def _loader(items):
+    async def load():
+        await asyncio.sleep(0)
+        return {"ok": True, "user_id": USER_ID, "items": items}
+
+    return load
+
+
+def test_concurrent_misses_share_one_load(fake_redis):
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"ok": True, "user_id": USER_ID, "items": ["milk"]}
+
+    async def main():
+        return await asyncio.gather(*(cucki_main._cached(KEY, load) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(r["items"] == ["milk"] for r in results)
+
+
+def test_fill_during_redis_delete_does_not_outlive_invalidation(fake_redis):
+    # Redis still holds the pre-write (empty) list while the mutation's SCAN/DELETE is in flight.
+    fake_redis.data[KEY] = orjson.dumps({"ok": True, "user_id": USER_ID, "items": []})
+
+    async def main():
+        fake_redis.scan_gate.clear()
+        invalidation = asyncio.ensure_future(
+            cucki_main._invalidate_lists(cucki_main.SHOPPING_CACHE, [{"user_id": USER_ID}])
+        )
+        await fake_redis.scanning.wait()
+        # A poll lands in the gap and sees the old Redis value.
+        during = await cucki_main._cached(KEY, _loader(["milk"]))
+        fake_redis.scan_gate.set()
+        await invalidation
+        after = await cucki_main._cached(KEY, _loader(["milk"]))
+        return during, after
+
+    during, after = asyncio.run(main())
+    assert during["items"] == []
+    assert after["items"] == ["milk"]
+
+
+def test_fill_racing_another_worker_write_skips_redis_set(fake_redis):
+    release = asyncio.Event()
+
+    async def slow_load():
+        await release.wait()
+        return {"ok": True, "user_id": USER_ID, "items": []}
+
+    async def main():
+        fill = asyncio.ensure_future(cucki_main._cached(KEY, slow_load))
+        await asyncio.sleep(0.01)
+        # Another worker's write bumps the generation and deletes the (absent) Redis keys.
+        await fake_redis.incr(cucki_main._gen_key(KEY))
+        release.set()
+        return await fill
+
+    assert asyncio.run(main())["items"] == []
+    assert KEY not in fake_redis.data
+
+
+def test_fill_stores_in_redis_when_generation_unchanged(fake_redis):
+    asyncio.run(cucki_main._cached(KEY, _loader(["milk"])))
+    assert orjson.loads(fake_redis.data[KEY])["items"] == ["milk"]